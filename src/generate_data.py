@@ -1,15 +1,14 @@
 import os
 import sys
 import json
-from collections import defaultdict
-from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
+from datetime import datetime, timedelta
 from pathlib import Path
 
-from notion_client import Client
+import numpy as np
 from dotenv import load_dotenv
 
-TAIPEI = ZoneInfo("Asia/Taipei")
+from heatmap_core import TAIPEI, aggregate_daily, fetch_records, heatmap_window
+from notion_common import make_notion_client
 
 
 def main():
@@ -27,73 +26,15 @@ def main():
         print("Error: NOTION_TOKEN or NOTION_DATASOURCE_ID not set.")
         sys.exit(1)
 
-    # Date window: 52 weeks back, aligned to Monday
-    today = datetime.now(TAIPEI).date()
-    one_year_ago = today - timedelta(weeks=52)
-    start_date = one_year_ago - timedelta(days=one_year_ago.weekday())
+    start_date, today = heatmap_window()
     print(f"Querying window: {start_date} to {today}")
 
-    notion = Client(auth=NOTION_TOKEN)
-    daily = defaultdict(float)
-    total_records = 0
-
-    has_more = True
-    start_cursor = None
-    while has_more:
-        try:
-            response = notion.data_sources.query(
-                data_source_id=NOTION_DATASOURCE_ID,
-                start_cursor=start_cursor,
-                page_size=100,
-                filter={
-                    "timestamp": "created_time",
-                    "created_time": {"on_or_after": start_date.isoformat()},
-                },
-            )
-        except Exception as e:
-            print(f"Error querying Notion: {e}")
-            sys.exit(1)
-
-        for page in response.get("results", []):
-            props = page.get("properties", {})
-
-            # --- Extract date (same three fallbacks as before) ---
-            date_prop = props.get(DATE_PROP, {})
-            date_str = None
-            if date_prop.get("type") == "date":
-                d = date_prop.get("date")
-                if d:
-                    date_str = d.get("start")
-            if not date_str and date_prop.get("type") == "created_time":
-                date_str = date_prop.get("created_time")
-            if not date_str:
-                content = date_prop.get("title", []) or date_prop.get("rich_text", [])
-                if content:
-                    mention = content[0].get("mention") or {}
-                    date_str = (mention.get("date") or {}).get("start")
-            if not date_str:
-                continue
-
-            # --- Extract duration (rollup.number) ---
-            duration = props.get(DURATION_PROP, {}).get("rollup", {}).get("number")
-            if duration is None:
-                continue
-
-            # --- Parse & convert to Asia/Taipei local date ---
-            try:
-                dt = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-            except ValueError:
-                continue
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-            local_date = dt.astimezone(TAIPEI).date()
-
-            daily[local_date.isoformat()] += float(duration)
-            total_records += 1
-
-        has_more = response.get("has_more", False)
-        start_cursor = response.get("next_cursor")
-        print(f"Total records so far: {total_records}")
+    notion = make_notion_client(NOTION_TOKEN)
+    records = fetch_records(
+        notion, NOTION_DATASOURCE_ID, DATE_PROP, DURATION_PROP, start_date, today
+    )
+    print(f"Total records: {len(records)}")
+    daily = aggregate_daily(records, start_date, today)
 
     output_dir = Path("public")
     output_dir.mkdir(exist_ok=True)
@@ -103,13 +44,16 @@ def main():
         "start_date": start_date.isoformat(),
         "end_date": today.isoformat(),
         # minutes per day; days with 0 are omitted, the page fills them in
-        "days": dict(sorted(daily.items())),
+        "days": {
+            (start_date + timedelta(days=int(i))).isoformat(): float(daily[i])
+            for i in np.flatnonzero(daily)
+        },
     }
 
     out_path = output_dir / "heatmap.json"
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
-    print(f"Data saved to {out_path} ({len(daily)} active days)")
+    print(f"Data saved to {out_path} ({len(payload['days'])} active days)")
 
 
 if __name__ == "__main__":
@@ -1,15 +1,41 @@
 import os
 import sys
 import collections
-from datetime import datetime
+import heapq
+import operator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
 from dotenv import load_dotenv
-from notion_client import Client
-from wordcloud import WordCloud
 from wordcloud import WordCloud
+import wordcloud.wordcloud as wordcloud_module
+from PIL import ImageFont
 import matplotlib.font_manager as fm
+import random
 import re
+import functools
+
+from notion_common import get_property_extractors, make_notion_client, sync_pages
+
+# Per-page (year, tags) from previous runs, so repeated runs only fetch what changed
+CACHE_PATH = Path("public/.cache/wordcloud_cache.json")
+CACHE_VERSION = 1
+# Deletions never show up in an incremental query, so re-download everything at least
+# this often. The workflow runs daily, so a one-day interval would make every
+# scheduled run a full sync.
+FULL_SYNC_INTERVAL = timedelta(days=7)
+# Formula values change without touching the page's last_edited_time, so an
+# incremental query would miss the change
+COMPUTED_TYPES = {"formula"}
 
+# HTML wrapper around the image; __IMAGE__ and __TIMESTAMP__ are filled in per run
+HTML_TEMPLATE = (Path(__file__).parent / "word_cloud.html.tmpl").read_text(encoding="utf-8")
+
+# wordcloud calls ImageFont.truetype for every word at every font size it tries;
+# loading the font file once per (path, size) turns those reloads into cache hits
+cached_truetype = functools.lru_cache(maxsize=None)(ImageFont.truetype)
+
+@functools.cache
 def get_chinese_font_path():
     """Attempt to find a suitable Chinese font on the system."""
     # List of common Chinese font names on macOS/Linux/Windows
@@ -38,6 +64,110 @@ def get_chinese_font_path():
 
     return None
 
+# Full-width commas become ASCII ones; the split pattern eats the spaces around each comma
+_COMMA_TRANS = str.maketrans({"，": ","})
+_SPLIT_TAGS = re.compile(r"\s*,\s*").split
+
+# Aesthetic palette: Earthy/Wenqing tones
+# Muted variations of Brown, Teal, Slate, Sage
+PALETTE = (
+    "hsl(30, 40%, 50%)",   # Muted Brown
+    "hsl(180, 20%, 40%)",  # Dark Teal
+    "hsl(210, 30%, 60%)",  # Muted Blue/Slate
+    "hsl(150, 20%, 50%)",  # Sage Green
+    "hsl(350, 30%, 60%)",  # Dusty Rose
+    "hsl(25, 60%, 45%)",   # Burnt Orange
+    "hsl(200, 40%, 45%)"   # Steel Blue
+)
+# Own seeded generator: unchanged tag counts are colored the same way on every run
+_pick_color = random.Random(0).choice
+
+def similar_color_func(word, font_size, position, orientation, random_state=None, **kwargs):
+    return _pick_color(PALETTE)
+
+def split_tags(text_content):
+    """Split comma separated tags (ASCII or full-width commas)."""
+    return [x for x in _SPLIT_TAGS(text_content.translate(_COMMA_TRANS).strip()) if x]
+
+def _plain_text(rich_text):
+    return "".join(t["plain_text"] for t in rich_text)
+
+def _formula_tags(tag_prop):
+    # Formula can return string, number, boolean, date. Only a string holds tags.
+    formula_val = tag_prop["formula"]
+    return split_tags(formula_val["string"] or "") if formula_val["type"] == "string" else []
+
+# The tag property has one type for the whole data source, so its extractor is chosen
+# once from the schema instead of re-checking each page's "type". Extractors index
+# directly; the caller treats KeyError/TypeError (e.g. an unset select) as no tags.
+TAG_EXTRACTORS = {
+    "multi_select": lambda tag_prop: [options["name"] for options in tag_prop["multi_select"]],
+    "select": lambda tag_prop: [tag_prop["select"]["name"]],
+    # Fallback if tags are comma separated text
+    "rich_text": lambda tag_prop: split_tags(_plain_text(tag_prop["rich_text"])),
+    "formula": _formula_tags,
+}
+
+# Server-side condition matching pages that have any tags, by tag property type.
+# No formula entry: the schema does not say what a formula returns, and a string
+# condition on a number/checkbox/date formula is rejected by Notion.
+TAG_NOT_EMPTY_FILTERS = {
+    "multi_select": {"multi_select": {"is_not_empty": True}},
+    "select": {"select": {"is_not_empty": True}},
+    "rich_text": {"rich_text": {"is_not_empty": True}},
+}
+
+_first_number = re.compile(r"\d+").search
+
+def year_from_text(text):
+    """Return the first run of digits in text as the year, 0 if there is none."""
+    match = _first_number(text)
+    return int(match.group()) if match else 0
+
+def _formula_year(year_prop):
+    formula_val = year_prop["formula"]
+    if formula_val["type"] == "number":
+        return formula_val["number"]
+    if formula_val["type"] == "string":
+        return year_from_text(formula_val["string"])
+    return 0
+
+# Same idea for the year property; a missing or empty value counts as year 0
+YEAR_EXTRACTORS = {
+    "number": lambda year_prop: year_prop["number"],
+    "select": lambda year_prop: year_from_text(year_prop["select"]["name"]),
+    "formula": _formula_year,
+    # Year might be the title
+    "title": lambda year_prop: year_from_text(_plain_text(year_prop["title"])),
+    "rich_text": lambda year_prop: year_from_text(_plain_text(year_prop["rich_text"])),
+}
+
+def iter_query_results(notion, data_source_id, prop_ids, query_filter):
+    """Yield each batch of query results while the request for the next batch is in flight."""
+    query_kwargs = {} if query_filter is None else {"filter": query_filter}
+    query = functools.partial(
+        notion.data_sources.query,
+        data_source_id=data_source_id,
+        page_size=100,
+        filter_properties=prop_ids, # only the columns we read, not every property of every page
+        **query_kwargs,
+    )
+    # One background worker: the next cursor's round trip overlaps with processing this batch
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(query)
+        while pending is not None:
+            try:
+                response = pending.result()
+            except Exception as e:
+                print(f"Error querying Notion: {e}")
+                sys.exit(1)
+            pending = None
+            if response.get("has_more", False):
+                pending = pool.submit(query, start_cursor=response.get("next_cursor"))
+            results = response.get("results", [])
+            print(f"Fetched {len(results)} pages.")
+            yield results
+
 def main():
     # Load environment variables
     load_dotenv(encoding='utf-8')
@@ -76,138 +206,71 @@ def main():
     print(f"  Target Year:   {TARGET_YEAR}")
 
     # Initialize Notion Client
-    notion = Client(auth=NOTION_TOKEN)
-    
-    tag_list = []
-    
-    print("Querying Notion...")
-    has_more = True
-    start_cursor = None
+    # Pooled keep-alive HTTP/2 connection with orjson decoding, shared with the heatmap scripts
+    notion = make_notion_client(NOTION_TOKEN)
     
-    while has_more:
-        try:
-            response = notion.data_sources.query(
-                data_source_id=NOTION_DATASOURCE_ID,
-                start_cursor=start_cursor,
-                page_size=100
-            )
-        except Exception as e:
-            print(f"Error querying Notion: {e}")
-            sys.exit(1)
-        
-        results = response.get("results", [])
-        
-        for page in results:
-            props = page.get("properties", {})
-            
-            # --- Year Filtering ---
-            # Default: Assume we skip unless we confirm the year matches
-            include_page = False
-            
-            year_prop = props.get(YEAR_PROP)
-            if year_prop:
-                ty = year_prop.get("type")
-                page_year = 0
-                if ty == "number":
-                    page_year = year_prop.get("number")
-                elif ty == "select":
-                    sel = year_prop.get("select")
-                    if sel:
-                        try:
-                             # Extract digits only
-                             match = re.search(r'\d+', sel.get("name"))
-                             if match:
-                                 page_year = int(match.group())
-                        except:
-                            pass
-                elif ty == "formula":
-                    form = year_prop.get("formula")
-                    if form.get("type") == "number":
-                        page_year = form.get("number")
-                    elif form.get("type") == "string":
-                        try:
-                             match = re.search(r'\d+', form.get("string"))
-                             if match:
-                                 page_year = int(match.group())
-                        except:
-                            pass
-                elif ty == "title":
-                    # Year might be the title
-                    title_list = year_prop.get("title", [])
-                    if title_list:
-                         plain = "".join([t.get("plain_text", "") for t in title_list])
-                         try:
-                             match = re.search(r'\d+', plain)
-                             if match:
-                                 page_year = int(match.group())
-                         except:
-                             pass
-                elif ty == "rich_text":
-                     rt_list = year_prop.get("rich_text", [])
-                     if rt_list:
-                         plain = "".join([t.get("plain_text", "") for t in rt_list])
-                         try:
-                             match = re.search(r'\d+', plain)
-                             if match:
-                                 page_year = int(match.group())
-                         except:
-                             pass
-                
-                # Debug print (limited to first 20 to avoid spam if many)
-                # if len(results) < 20: 
-                #     print(f"DEBUG: Page Year: {page_year}, Target: {TARGET_YEAR}, PropType: {ty}") 
-                #     if page_year == 0:
-                #         print(f"DEBUG: RAW PROP: {year_prop}")
-
-                if page_year == TARGET_YEAR:
-                    include_page = True
-            
-            if not include_page:
-                continue
-            # ----------------------
+    (tags_schema, extract_tags), (year_schema, extract_year) = get_property_extractors(
+        notion, NOTION_DATASOURCE_ID, {TAGS_PROP: TAG_EXTRACTORS, YEAR_PROP: YEAR_EXTRACTORS}
+    )
+    prop_ids = [tags_schema["id"], year_schema["id"]]
 
-            tag_prop = props.get(TAGS_PROP)
-            
-            if not tag_prop:
-                continue
-                
-            prop_type = tag_prop.get("type")
-            
+    computed = [
+        name for name, schema in ((TAGS_PROP, tags_schema), (YEAR_PROP, year_schema))
+        if schema["type"] in COMPUTED_TYPES
+    ]
+    # A computed property always needs a full sync, so its cache would never be read
+    use_cache = not computed
+    if not use_cache:
+        print(f"{', '.join(computed)} computed by a formula; edits are not tracked, so syncing in full")
+
+    def fetch(edited_since):
+        if edited_since is None:
+            # Pages without tags add nothing to the cloud, so they never leave Notion
+            not_empty = TAG_NOT_EMPTY_FILTERS.get(tags_schema["type"])
+            query_filter = None if not_empty is None else {"property": tags_schema["id"], **not_empty}
+        else:
+            # No tag condition here: a page whose tags were cleared must still come back
+            # so its cached tags are emptied
+            query_filter = {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": edited_since},
+            }
+        return iter_query_results(notion, NOTION_DATASOURCE_ID, prop_ids, query_filter)
+
+    def parse(page):
+        """Return [year, tags] for a page; every page is cached with its year, so the
+        cache serves any TARGET_YEAR."""
+        props = page["properties"]
+        # Missing or empty values (e.g. an unset select) count as no year / no tags
+        try:
+            page_year = extract_year(props[YEAR_PROP])
+        except (KeyError, TypeError):
+            page_year = 0
+        try:
+            names = extract_tags(props[TAGS_PROP])
+        except (KeyError, TypeError):
             names = []
-            if prop_type == "multi_select":
-                names = [options["name"] for options in tag_prop.get("multi_select", [])]
-            elif prop_type == "select":
-                select_obj = tag_prop.get("select")
-                if select_obj:
-                    names = [select_obj.get("name")]
-            elif prop_type == "rich_text":
-                # Fallback if tags are comma separated text
-                rt = tag_prop.get("rich_text", [])
-                if rt:
-                    text_content = "".join([t.get("plain_text", "") for t in rt])
-                    # Split by common separators
-                    names = [x.strip() for x in text_content.replace("，", ",").split(",") if x.strip()]
-            elif prop_type == "formula":
-                 # Handle Formula returning a string of tags
-                 formula_val = tag_prop.get("formula", {})
-                 # Formula can return string, number, boolean, date. Assuming string here based on debug.
-                 if formula_val.get("type") == "string":
-                     text_content = formula_val.get("string") or ""
-                     names = [x.strip() for x in text_content.replace("，", ",").split(",") if x.strip()]
-            
-            tag_list.extend(names)
-            
-        has_more = response.get("has_more", False)
-        start_cursor = response.get("next_cursor")
-        print(f"Fetched {len(results)} pages. Total tags accumulated: {len(tag_list)}")
+        return [page_year, names]
+
+    print("Querying Notion...")
+    cache = sync_pages(
+        fetch, parse, CACHE_PATH, CACHE_VERSION, NOTION_DATASOURCE_ID, [TAGS_PROP, YEAR_PROP],
+        FULL_SYNC_INTERVAL, use_cache=use_cache,
+    )
 
-    if not tag_list:
+    # Count Frequencies over the cached pages of the target year
+    text_freq = collections.Counter()
+    for page_year, names in cache["pages"].values():
+        if page_year == TARGET_YEAR:
+            text_freq.update(names)
+    print(f"Total tags for {TARGET_YEAR}: {text_freq.total()}")
+
+    if not text_freq:
         print("No tags found.")
         sys.exit(0)
 
-    # Count Frequencies
-    text_freq = collections.Counter(tag_list)
-    print(f"Top tags: {text_freq.most_common(10)}")
+    if os.environ.get("DEBUG"):
+        print(f"Top tags: {heapq.nlargest(10, text_freq.items(), key=operator.itemgetter(1))}")
 
     # --- Font Setup ---
     # User provided font (ExtraBold)
@@ -215,31 +278,16 @@ def main():
     local_font_path = Path(font_name)
     
     # Check if exists
-    if not local_font_path.exists():
+    if local_font_path.exists():
+        final_font_path = str(local_font_path)
+    else:
         print(f"Font {font_name} not found in root directory.")
         print(f"Please ensure it is placed in: {os.getcwd()}")
         print("Falling back to system font for now...")
-        local_font_path = Path(get_chinese_font_path())
-
-    final_font_path = str(local_font_path) if local_font_path.exists() else get_chinese_font_path()
+        # Look the system font up once; the lookup scans the disk and the font manager
+        final_font_path = get_chinese_font_path()
     print(f"Using font: {final_font_path}")
     
-    # --- Custom Colors ---
-    import random
-    def similar_color_func(word, font_size, position, orientation, random_state=None, **kwargs):
-        # Aesthetic palette: Earthy/Wenqing tones
-        # Muted variations of Brown, Teal, Slate, Sage
-        colors = [
-            "hsl(30, 40%, 50%)",   # Muted Brown
-            "hsl(180, 20%, 40%)",  # Dark Teal
-            "hsl(210, 30%, 60%)",  # Muted Blue/Slate
-            "hsl(150, 20%, 50%)",  # Sage Green
-            "hsl(350, 30%, 60%)",  # Dusty Rose
-            "hsl(25, 60%, 45%)",   # Burnt Orange
-            "hsl(200, 40%, 45%)"   # Steel Blue
-        ]
-        return random.choice(colors)
-
     # --- Generate ---
     # Create public directory
     output_dir = Path("public")
@@ -247,21 +295,32 @@ def main():
     
     wc = WordCloud(
         font_path=final_font_path,
-        width=1200, # Increased resolution
-        height=600,
+        # Lay words out on a 600x300 grid and draw them 2x, so the saved image is still
+        # 1200x600 but placement searches a quarter of the pixels. Sizes below are in
+        # layout pixels, i.e. half of what ends up in the image.
+        width=600,
+        height=300,
+        scale=2,
         mode="RGBA",
         background_color=None, # Transparent
-        min_font_size=12,
-        max_font_size=120,
-        margin=5,
+        min_font_size=6,
+        max_font_size=60,
+        margin=3,
         prefer_horizontal=1.0, # NO ROTATION
         color_func=similar_color_func, # Custom colors
-        regexp=r"\w+" # Simple regex
+        collocations=False, # Frequencies are given directly; no text tokenizing or bigrams
     )
     
-    wc.generate_from_frequencies(text_freq)
+    # Route wordcloud's font loading through the cache. wordcloud's ImageFont is PIL's
+    # own module, so this patches PIL globally; restore the original once drawn.
+    original_truetype = wordcloud_module.ImageFont.truetype
+    wordcloud_module.ImageFont.truetype = cached_truetype
+    try:
+        wc.generate_from_frequencies(text_freq)
+        image = wc.to_image() # draws at scale, loading fonts again
+    finally:
+        wordcloud_module.ImageFont.truetype = original_truetype
     
-    # Save Image
     # Save Image
     if USE_EXPLICIT_YEAR_FILENAME:
         output_filename = f"word_cloud_{TARGET_YEAR}.png"
@@ -269,49 +328,21 @@ def main():
         output_filename = "word_cloud.png"
         
     output_img_path = output_dir / output_filename
-    wc.to_file(str(output_img_path))
+    # The PNG is committed on every run and downloaded on every view, so spend the
+    # extra ~0.1s of encoding on the smallest file Pillow can write
+    image.save(output_img_path, format="PNG", optimize=True)
     print(f"Saved word cloud image to {output_img_path}")
     
     # Generate HTML wrapper
     timestamp = int(datetime.now().timestamp())
-    html_content = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Reading Tags Word Cloud</title>
-    <style>
-        body, html {{
-            margin: 0;
-            padding: 0;
-            width: 100%;
-            height: 100%;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            background: transparent;
-        }}
-        img {{
-            max-width: 100%;
-            max-height: 100%;
-            object-fit: contain;
-        }}
-    </style>
-</head>
-<body>
-    <img src="{output_filename}?t={timestamp}" alt="Word Cloud">
-</body>
-</html>
-    """
+    html_content = HTML_TEMPLATE.replace("__IMAGE__", output_filename).replace("__TIMESTAMP__", str(timestamp))
     
     if USE_EXPLICIT_YEAR_FILENAME:
         output_html_path = output_dir / f"word_cloud_{TARGET_YEAR}.html"
     else:
         output_html_path = output_dir / "word_cloud.html"
         
-    with open(output_html_path, "w", encoding="utf-8") as f:
-        f.write(html_content.strip())
+    output_html_path.write_text(html_content, encoding="utf-8")
         
     print(f"Saved HTML wrapper to {output_html_path}")
 
@@ -0,0 +1,210 @@
+"""Shared Notion fetching and daily aggregation for the heatmap scripts."""
+
+import os
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from notion_common import get_property_extractors, sync_pages
+
+TAIPEI = ZoneInfo("Asia/Taipei")
+# Enough concurrent queries to keep the client's request throttle (3 requests/s,
+# see notion_common) busy while each one waits on its round trip
+MAX_WORKERS = 3
+# Per-page results from previous runs, so repeated runs only fetch what changed
+CACHE_PATH = Path("public/.cache/notion_cache.json")
+CACHE_VERSION = 2
+# Deletions never show up in an incremental query, so re-download everything at least this often
+FULL_SYNC_INTERVAL = timedelta(days=1)
+# Duration types computed from other pages or properties: their values change without
+# touching the page's last_edited_time, so an incremental query would miss the change
+COMPUTED_DURATION_TYPES = {"rollup", "formula"}
+
+
+def heatmap_window():
+    """Return (start_date, today): 52 weeks back in Asia/Taipei, aligned to Monday."""
+    today = datetime.now(TAIPEI).date()
+    one_year_ago = today - timedelta(weeks=52)
+    start_date = one_year_ago - timedelta(days=one_year_ago.weekday())
+    return start_date, today
+
+
+def _mention_date(rich_text):
+    return rich_text[0]["mention"]["date"]["start"]
+
+
+# A property's type is the same on every page, so the extractor is chosen once from the
+# schema instead of re-dispatching on each page's "type"
+DATE_EXTRACTORS = {
+    "date": lambda prop: prop["date"]["start"],
+    "created_time": lambda prop: prop["created_time"],
+    # Title/RichText Property with a date Mention
+    "title": lambda prop: _mention_date(prop["title"]),
+    "rich_text": lambda prop: _mention_date(prop["rich_text"]),
+}
+DURATION_EXTRACTORS = {
+    "rollup": lambda prop: prop["rollup"]["number"],
+    "number": lambda prop: prop["number"],
+    "formula": lambda prop: prop["formula"]["number"],
+}
+
+
+def month_windows(start_date, end_date):
+    """Split the window into disjoint [start, end) months; the last one is open-ended."""
+    bounds = [start_date]
+    month = start_date.replace(day=1)
+    while True:
+        month = (month + timedelta(days=32)).replace(day=1)
+        if month > end_date:
+            break
+        bounds.append(month)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def query_window(notion, data_source_id, prop_ids, window, edited_since=None):
+    """Fetch every page created inside one window, following pagination cursors."""
+    window_start, window_end = window
+    conditions = [
+        {"timestamp": "created_time", "created_time": {"on_or_after": window_start.isoformat()}},
+    ]
+    if window_end is not None:
+        conditions.append(
+            {"timestamp": "created_time", "created_time": {"before": window_end.isoformat()}}
+        )
+    if edited_since is not None:
+        conditions.append(
+            {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": edited_since}}
+        )
+
+    pages = []
+    start_cursor = None
+    while True:
+        response = notion.data_sources.query(
+            data_source_id=data_source_id,
+            start_cursor=start_cursor,
+            page_size=100,
+            filter_properties=prop_ids,
+            filter={"and": conditions},
+        )
+        pages.extend(response.get("results", []))
+        if not response.get("has_more", False):
+            return pages
+        start_cursor = response.get("next_cursor")
+
+
+def fetch_pages(notion, data_source_id, prop_ids, windows, edited_since=None):
+    """Query all windows concurrently and return their pages in window order."""
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(query_window, notion, data_source_id, prop_ids, window, edited_since): i
+            for i, window in enumerate(windows)
+        }
+        results = [None] * len(windows)
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"Error querying Notion: {e}")
+                pool.shutdown(cancel_futures=True)
+                sys.exit(1)
+            window_start = windows[futures[future]][0]
+            print(f"Fetched {len(results[futures[future]])} pages from {window_start:%Y-%m}")
+    return [page for pages in results for page in pages]
+
+
+def parse_page(page, date_prop, duration_prop, extract_date, extract_duration):
+    """Return the raw (ISO date string, minutes) of a page; missing parts are '' and None."""
+    props = page["properties"]
+    try:
+        date_str = extract_date(props[date_prop])
+    except (KeyError, IndexError, TypeError):
+        date_str = None
+    try:
+        duration = extract_duration(props[duration_prop])
+    except (KeyError, TypeError):
+        duration = None
+
+    # No per-page validity check: aggregate_daily masks out missing values in one pass
+    return date_str or "", duration
+
+
+def fetch_records(notion, data_source_id, date_prop, duration_prop, start_date, end_date):
+    """Return (date string, minutes) for every page in the window, syncing through the cache.
+
+    A full sync downloads the window month by month; an incremental one sends one query
+    for pages edited since the newest edit already cached. Rollup and formula durations
+    always sync in full and neither read nor write the cache.
+    """
+    (date_schema, extract_date), (duration_schema, extract_duration) = get_property_extractors(
+        notion, data_source_id, {date_prop: DATE_EXTRACTORS, duration_prop: DURATION_EXTRACTORS}
+    )
+    # Only download the two properties we read, not every column of every page
+    prop_ids = [date_schema["id"], duration_schema["id"]]
+
+    # A computed duration always needs a full sync, so its cache would never be read
+    use_cache = duration_schema["type"] not in COMPUTED_DURATION_TYPES
+    if not use_cache:
+        print(f"'{duration_prop}' is a {duration_schema['type']}; edits to it are not tracked, so syncing in full")
+
+    def fetch(edited_since):
+        if edited_since is None:
+            windows = month_windows(start_date, end_date)
+        else:
+            windows = [(start_date, None)] # one query for everything edited since
+        pages = fetch_pages(notion, data_source_id, prop_ids, windows, edited_since)
+
+        if pages and os.environ.get("DEBUG"):
+            # DEBUG: Print the first page's properties to help debug
+            first_page_props = pages[0].get("properties", {})
+            print("\n--- DEBUG: Properties Keys found in first page ---")
+            print(list(first_page_props.keys()))
+            print(f"\n--- DEBUG: Content of property '{date_prop}' ---")
+            print(json.dumps(first_page_props.get(date_prop), indent=2, default=str))
+            print(f"\n--- DEBUG: Content of property '{duration_prop}' ---")
+            print(json.dumps(first_page_props.get(duration_prop), indent=2, default=str))
+            print("------------------------------------------------\n")
+        return [pages]
+
+    # Drop pages that have slid out of the 52-week window. Dates are stored raw (UTC or
+    # with an offset), so keep one spare day for the shift to Asia/Taipei.
+    cutoff = (start_date - timedelta(days=1)).isoformat()
+    cache = sync_pages(
+        fetch,
+        lambda page: parse_page(page, date_prop, duration_prop, extract_date, extract_duration),
+        CACHE_PATH, CACHE_VERSION, data_source_id, [date_prop, duration_prop], FULL_SYNC_INTERVAL,
+        use_cache=use_cache,
+        keep=lambda entry: entry[0][:10] >= cutoff,
+    )
+    return list(cache["pages"].values())
+
+
+def aggregate_daily(records, start_date, end_date):
+    """Sum minutes per Asia/Taipei day into a dense array with one slot per day of the window."""
+    num_days = (end_date - start_date).days + 1
+    if not records:
+        return np.zeros(num_days)
+    dates, values = zip(*records)
+
+    # Notion returns created_time in UTC (e.g., 2025-12-03T05:53:00.000Z); convert to the
+    # user's timezone (Asia/Taipei) to match their "Today". Parse every timestamp in one
+    # call (naive values are treated as UTC) and keep only the local calendar day.
+    local_days = (
+        pd.to_datetime(list(dates), utc=True, format="ISO8601", errors="coerce")
+        .tz_convert(TAIPEI)
+        .tz_localize(None)
+        .to_numpy()
+        .astype("datetime64[D]")
+    )
+    durations = np.array(values, dtype=np.float64)  # missing durations (None) become NaN
+
+    # Missing or unparseable dates (NaT), missing durations and days outside the window
+    # all fall out of one mask
+    offsets = (local_days - np.datetime64(start_date, "D")).astype(np.int64)
+    valid = (offsets >= 0) & (offsets < num_days) & ~np.isnan(durations)
+    return np.bincount(offsets[valid], weights=durations[valid], minlength=num_days)
@@ -0,0 +1,168 @@
+"""Notion client setup, schema lookup and the incremental page cache shared by all scripts."""
+
+import os
+import sys
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+import orjson
+from notion_client import Client
+
+# Notion allows an average of ~3 requests/s per integration; every client paces its
+# requests to this rate, so more idle connections than that are never reused
+REQUESTS_PER_SECOND = 3
+MAX_KEEPALIVE_CONNECTIONS = REQUESTS_PER_SECOND
+
+
+def make_throttle(rate):
+    """Return an httpx request hook that starts at most `rate` requests per second,
+    shared by every thread using the client."""
+    interval = 1 / rate
+    lock = threading.Lock()
+    next_slot = 0.0
+
+    def throttle(request):
+        nonlocal next_slot
+        with lock:
+            now = time.monotonic()
+            wait = max(next_slot - now, 0.0)
+            next_slot = now + wait + interval
+        time.sleep(wait)
+
+    return throttle
+
+
+def decode_with_orjson(response):
+    """httpx response hook: parse this client's JSON bodies with orjson instead of stdlib json."""
+    response.json = lambda **kwargs: orjson.loads(response.content)
+
+
+def make_notion_client(token):
+    """Build a Notion client on one pooled HTTP/2 connection shared by all worker threads.
+
+    Requests are paced to REQUESTS_PER_SECOND; 429s that still happen are retried by
+    notion-client.
+    """
+    # notion-client replaces the client's headers, but httpx still adds its default
+    # Accept-Encoding (gzip, deflate), so responses stay compressed
+    transport = httpx.HTTPTransport(
+        http2=True,
+        retries=3,  # reconnects only; 429s are retried by notion-client
+        limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+    )
+    http_client = httpx.Client(
+        transport=transport,
+        event_hooks={
+            "request": [make_throttle(REQUESTS_PER_SECOND)],
+            "response": [decode_with_orjson],
+        },
+    )
+    return Client(auth=token, client=http_client)
+
+
+def get_property_schemas(notion, data_source_id, names):
+    """Look up each named property's schema (id and type) once for the whole run."""
+    schema = notion.data_sources.retrieve(data_source_id=data_source_id)
+    properties = schema.get("properties", {})
+    missing = [name for name in names if name not in properties]
+    if missing:
+        print(f"Error: properties {missing} not found in data source.")
+        sys.exit(1)
+    return [properties[name] for name in names]
+
+
+def get_property_extractors(notion, data_source_id, extractors_by_name):
+    """Look up the named properties once and choose each one's extractor by its schema type.
+
+    extractors_by_name maps a property name to its {type: extractor} table; returns
+    (schema, extractor) pairs in the same order. Exits on an unsupported type.
+    """
+    names = list(extractors_by_name)
+    try:
+        schemas = get_property_schemas(notion, data_source_id, names)
+    except Exception as e:
+        print(f"Error retrieving data source schema: {e}")
+        sys.exit(1)
+    extractors = [extractors_by_name[name].get(schema["type"]) for name, schema in zip(names, schemas)]
+    if None in extractors:
+        found = ", ".join(f"'{name}' is {schema['type']}" for name, schema in zip(names, schemas))
+        print(f"Error: unsupported property types: {found}.")
+        sys.exit(1)
+    return list(zip(schemas, extractors))
+
+
+def load_cache(path, version, data_source_id, props):
+    """Read a page cache; an unreadable or outdated cache, or another data source or
+    other properties than it was parsed from, means a full sync."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        cache.get("version") != version
+        or cache.get("data_source_id") != data_source_id
+        or cache.get("props") != props
+    ):
+        return None
+    return cache
+
+
+def save_cache(path, cache):
+    """Write the cache next to its final location and swap it in atomically."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def sync_pages(fetch, parse, path, version, data_source_id, props, full_sync_interval,
+               use_cache=True, keep=None):
+    """Bring the page cache at path up to date with Notion and return it.
+
+    Runs a full sync when use_cache is false, FULL_SYNC is set, there is no usable
+    cache, or the last full sync is older than full_sync_interval; otherwise only
+    pages edited since the newest edit already cached are fetched.
+    fetch(edited_since) yields batches of pages, with edited_since None for a full
+    sync. parse(page) returns the JSON-serializable entry stored for a page, and
+    keep(entry), if given, drops entries from the cache before it is saved.
+    """
+    now = datetime.now(timezone.utc)
+    cache = None
+    if use_cache and not os.environ.get("FULL_SYNC"):
+        cache = load_cache(path, version, data_source_id, props)
+    if cache and now - datetime.fromisoformat(cache["full_sync_at"]) < full_sync_interval:
+        print(f"Incremental sync: pages edited since {cache['watermark']}")
+        edited_since = cache["watermark"]
+    else:
+        print("Full sync")
+        cache = {
+            "version": version,
+            "data_source_id": data_source_id,
+            "props": props,
+            "full_sync_at": now.isoformat(timespec="seconds"),
+            "watermark": None,
+            "pages": {},
+        }
+        edited_since = None
+
+    # Upsert by page id; last_edited_time is minute-precision ISO, so string max works
+    changed = 0
+    for pages in fetch(edited_since):
+        for page in pages:
+            cache["pages"][page["id"]] = parse(page)
+            edited = page.get("last_edited_time")
+            if edited and (cache["watermark"] is None or edited > cache["watermark"]):
+                cache["watermark"] = edited
+        changed += len(pages)
+    print(f"Fetched {changed} changed pages")
+
+    if keep is not None:
+        cache["pages"] = {page_id: entry for page_id, entry in cache["pages"].items() if keep(entry)}
+    if use_cache and cache["watermark"] is not None:
+        save_cache(path, cache)
+    return cache